@@ -4,8 +4,13 @@ from firebase_admin import credentials, firestore
 from datetime import datetime, timedelta, timezone
 from dateutil.relativedelta import relativedelta
 import calendar
+from collections import defaultdict
 import pandas as pd
-import uuid
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import time
+from google.api_core.exceptions import AlreadyExists, NotFound
 
 # --- ページ設定 ---
 st.set_page_config(
@@ -20,9 +25,11 @@ st.set_page_config(
 JST = timezone(timedelta(hours=+9), 'JST')
 
 EVENTS_COLLECTION = "v2_events"
-DAY_STATUS_COLLECTION = "v2_day_status"
+MONTH_STATUS_COLLECTION = "v2_month_status"  # 月ごとに {"01": true, "02": false, ...} の開催状況を持つ
 MONTH_LOCKS_COLLECTION = "v2_month_locks"
 BOARD_COLLECTION = "v2_bulletin_board"
+BOARD_MESSAGE_TTL = timedelta(weeks=2)  # 掲示板メッセージの保持期間（FirestoreのTTLポリシーで自動削除）
+BOARD_MESSAGE_LIMIT = 50  # 掲示板に表示する最大メッセージ数
 MAX_SHIFTS_PER_DAY = 5  # 1日に許可される最大シフト数
 
 # ユーザー属性と文字色の定義
@@ -33,6 +40,17 @@ USER_ATTRIBUTES = {
     "その他": "gray"
 }
 MINUTES_PER_SHIFT = 50  # 1回あたりの活動時間(分)
+MONTH_CACHE_TTL = 60  # セッション内の月データを再取得するまでの秒数
+
+# 属性カラーの凡例（内容が固定なので起動時に一度だけ組み立てる）
+LEGEND_HTML = (
+    "<div style='text-align:center; padding: 10px; background-color: #f0f2f6; border-radius: 5px; margin-bottom: 10px;'>"
+    + " &nbsp;&nbsp;|&nbsp;&nbsp; ".join(f"<span style='color:{color}; font-weight:bold;'>■ {attr}</span>" for attr, color in USER_ATTRIBUTES.items())
+    + "</div>"
+)
+# シフト1件分の表示テンプレート（管理者用・一般ユーザー用）
+_ADMIN_SHIFT_TMPL = "<div style='line-height:1.2;'><span style='color:{text_color}; font-size:0.9em;'>👤 {name}</span><br><span style='color:{time_color}; font-size:0.8em;'>({minutes}分)</span></div>"
+_SHIFT_TMPL = "<span style='color:{text_color}; font-size:0.9em;'>👤 {name}</span> <span style='color:{time_color}; font-size:0.8em;'>({minutes}分)</span>"
 
 # --- マニュアルのテキスト定義 ---
 USER_MANUAL_TEXT = """# 🗓️ 見守りシフト管理カレンダー 使い方ガイド
@@ -94,7 +112,7 @@ ADMIN_MANUAL_TEXT = """# 🛠️ 見守りシフト管理カレンダー 管理
 * 強制削除
   予定の変更などで参加できなくなった方のシフトを、管理者権限で横の [✖️] ボタンから削除できます。
 * 活動時間（分数）の変更
-  通常は1回50分ですが、遅刻や早退などで活動時間が変わった場合、名前の横にある [⏱️] アイコンを押して分数を修正できます。この分数が月末の活動実績（CSV）に反映されます。
+  通常は1回50分ですが、遅刻や早退などで活動時間が変わった場合、名前の横にある [⏱️] アイコンを押して分数を修正できます。修正後、カレンダーの下に表示される [💾 分数の変更を保存] ボタンを押すと確定します。この分数が月末の活動実績（CSV）に反映されます。
 
 ## 3. 月末の処理（実績集計とロック）
 月末になったら、以下の手順で活動実績の報告準備を行います。
@@ -144,45 +162,183 @@ if 'user_attribute' not in st.session_state:
     st.session_state.user_attribute = ""
 if 'agreed_to_terms' not in st.session_state:
     st.session_state.agreed_to_terms = False
-
-# --- データ取得・クリーンアップ関数 ---
-@st.cache_data(ttl=60)
-def get_firestore_data(year, month):
-    """指定された月のFirestoreデータを取得する"""
+if 'pending_minutes' not in st.session_state:
+    # doc_id -> 保存待ちの分数
+    st.session_state.pending_minutes = {}
+if 'month_cache' not in st.session_state:
+    # month_id -> ((events, day_status), 取得時刻)
+    st.session_state.month_cache = {}
+if 'prefetched_months' not in st.session_state:
+    # month_id -> 先読みした時刻
+    st.session_state.prefetched_months = {}
+if 'month_generations' not in st.session_state:
+    # month_id -> キャッシュを破棄した回数（裏での再取得結果が古くなっていないかの判定に使う）
+    st.session_state.month_generations = {}
+
+# --- データ取得関数 ---
+# 取得結果はシリアライズせずに共有するため、呼び出し側では変更しないこと（読み取り専用）
+def _stream_to_dict(query):
+    """クエリ結果を {ドキュメントID: データ} の辞書にする"""
+    return {doc.id: doc.to_dict() for doc in query.stream()}
+
+def _get_day_status(month_id):
+    """指定された月の開催状況を {"日(2桁)": 開催するか} の辞書で取得する"""
+    month_status_doc = db.collection(MONTH_STATUS_COLLECTION).document(month_id).get()
+    # 月ステータスが無い月は、まだ開催日が1日も設定されていない
+    return month_status_doc.to_dict() if month_status_doc.exists else {}
+
+# バックグラウンドのスレッドからも呼ぶため、スピナーは表示しない
+@st.cache_resource(ttl=60, show_spinner=False)
+def get_events_and_status(year, month):
+    """指定された月のシフトと開催状況を取得する"""
     month_id = f"{year}-{month:02d}"
     
     events_ref = db.collection(EVENTS_COLLECTION)
-    query = events_ref.where('month_id', '==', month_id)
-    events = {doc.id: doc.to_dict() for doc in query.stream()}
-    
-    day_status_ref = db.collection(DAY_STATUS_COLLECTION)
-    query = day_status_ref.where('month_id', '==', month_id)
-    day_status = {doc.id: doc.to_dict() for doc in query.stream()}
-    
+    # 表示に使うフィールドだけを転送する
+    events_query = events_ref.where('month_id', '==', month_id).select(['date', 'name', 'attribute', 'minutes'])
+
+    # 2つの読み込みは互いに独立しているので並行して取得する
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        events_future = executor.submit(_stream_to_dict, events_query)
+        day_status_future = executor.submit(_get_day_status, month_id)
+        return events_future.result(), day_status_future.result()
+
+@st.cache_resource(ttl=60, show_spinner=False)
+def get_month_lock(year, month):
+    """指定された月がロックされているかを取得する"""
+    month_id = f"{year}-{month:02d}"
     month_lock_doc = db.collection(MONTH_LOCKS_COLLECTION).document(month_id).get()
-    is_month_locked = month_lock_doc.exists and month_lock_doc.to_dict().get('isLocked', False)
+    return month_lock_doc.exists and month_lock_doc.to_dict().get('isLocked', False)
 
+@st.cache_resource(ttl=60)
+def get_board_messages():
+    """掲示板のメッセージを取得する"""
     board_ref = db.collection(BOARD_COLLECTION)
-    # 絞り込みを外し、全メッセージを新しい順に取得する
-    query = board_ref.order_by('timestamp', direction=firestore.Query.DESCENDING)
-    board_messages = [doc.to_dict() for doc in query.stream()]
+    # 保持期間内のメッセージだけをサーバー側で絞り込み、新しい順に上限件数まで取得する
+    # （TTLによる削除は即時ではないため、期限切れのメッセージもここで除外する）
+    since = datetime.now(JST) - BOARD_MESSAGE_TTL
+    query = (
+        board_ref.where('timestamp', '>', since)
+        .order_by('timestamp', direction=firestore.Query.DESCENDING)
+        .limit(BOARD_MESSAGE_LIMIT)
+        .select(['name', 'message', 'timestamp'])
+    )
+    return [doc.to_dict() for doc in query.stream()]
+
+def _refresh_month_cache(year, month, month_cache, month_generations):
+    """バックグラウンドで月データを再取得し、セッションのキャッシュを差し替える"""
+    month_id = f"{year}-{month:02d}"
+    generation = month_generations.get(month_id, 0)
+    data = get_events_and_status(year, month)
+    if month_generations.get(month_id, 0) != generation:
+        # 取得中に書き込みがあった場合、取得結果は書き込み前のものかもしれないので使わない
+        get_events_and_status.clear(year, month)
+        return
+    month_cache[month_id] = (data, time.time())
 
-    return events, day_status, is_month_locked, board_messages
+def get_month_data_stale_first(year, month):
+    """セッションに残っている月データを即座に返し、古ければ裏で再取得する"""
+    month_id = f"{year}-{month:02d}"
+    month_cache = st.session_state.month_cache
+    cached = month_cache.get(month_id)
+    if cached is None:
+        data = get_events_and_status(year, month)
+        month_cache[month_id] = (data, time.time())
+        return data
+
+    data, fetched_at = cached
+    if time.time() - fetched_at > MONTH_CACHE_TTL:
+        # 二重に再取得しないよう、先に取得時刻を更新しておく
+        month_cache[month_id] = (data, time.time())
+        # スレッドからは st.* を呼ばないので、スクリプトのコンテキストは渡さない
+        thread = threading.Thread(target=_refresh_month_cache, args=(year, month, month_cache, st.session_state.month_generations), daemon=True)
+        thread.start()
+    return data
+
+def _prefetch_month(year, month):
+    """指定された月のデータを取得してキャッシュを温めておく"""
+    get_events_and_status(year, month)
+    get_month_lock(year, month)
+
+def prefetch_adjacent_months(year, month):
+    """前後の月のデータをバックグラウンドで先読みする"""
+    base = datetime(year, month, 1)
+    prefetched_months = st.session_state.prefetched_months
+    now = time.time()
+    for offset in (-1, 1):
+        target = base + relativedelta(months=offset)
+        target_id = f"{target.year}-{target.month:02d}"
+        # 再実行のたびにスレッドを立てないよう、キャッシュの有効期間内は先読みし直さない
+        if target_id in st.session_state.month_cache or now - prefetched_months.get(target_id, 0) < MONTH_CACHE_TTL:
+            continue
+        prefetched_months[target_id] = now
+        # スレッドからは st.* を呼ばないので、スクリプトのコンテキストは渡さない
+        thread = threading.Thread(target=_prefetch_month, args=(target.year, target.month), daemon=True)
+        thread.start()
+
+def shift_doc_id(date_str, name, attribute):
+    """日付・名前・属性から決まるシフトのドキュメントIDを返す"""
+    digest = hashlib.sha256(f"{name}\n{attribute}".encode('utf-8')).hexdigest()[:20]
+    return f"{date_str}_{digest}"
+
+@firestore.transactional
+def _join_shift_in_transaction(transaction, ref, new_event):
+    """トランザクション内で重複と定員を確認し、シフトを作成する"""
+    day_query = db.collection(EVENTS_COLLECTION).where('date', '==', new_event['date'])
+    day_docs = list(transaction.get(day_query))
+    for doc in day_docs:
+        data = doc.to_dict()
+        if doc.id == ref.id or (data.get('name') == new_event['name'] and data.get('attribute', 'その他') == new_event['attribute']):
+            return 'exists'
+    if len(day_docs) >= MAX_SHIFTS_PER_DAY:
+        return 'full'
+    # 同じIDのドキュメントが既にあれば create は失敗するため、同時押しでも重複しない
+    transaction.create(ref, new_event)
+    return 'created'
+
+def join_shift(new_event):
+    """シフトを登録し、結果（'created' / 'exists' / 'full'）を返す"""
+    doc_id = shift_doc_id(new_event['date'], new_event['name'], new_event['attribute'])
+    ref = db.collection(EVENTS_COLLECTION).document(doc_id)
+    try:
+        return _join_shift_in_transaction(db.transaction(), ref, new_event)
+    except AlreadyExists:
+        return 'exists'
 
-def cleanup_old_board_messages():
-    """投稿から2週間以上経過した掲示板メッセージを削除する"""
-    # 2週間前も日本時間基準で計算する
-    two_weeks_ago = datetime.now(JST) - timedelta(weeks=2)
-    old_messages_query = db.collection(BOARD_COLLECTION).where('timestamp', '<', two_weeks_ago).stream()
-    
+def invalidate_month_cache(year, month):
+    """指定された月のシフト・開催状況のキャッシュだけを破棄する"""
+    month_id = f"{year}-{month:02d}"
+    # 裏で再取得中のスレッドが古い結果を書き戻さないよう、破棄より先に世代を進める
+    month_generations = st.session_state.month_generations
+    month_generations[month_id] = month_generations.get(month_id, 0) + 1
+    get_events_and_status.clear(year, month)
+    st.session_state.month_cache.pop(month_id, None)
+
+def commit_writes(year, month, ops):
+    """書き込み（'set' / 'merge' / 'update' / 'delete'）を1回のバッチでコミットし、その月のキャッシュを破棄する
+
+    ops は (操作, DocumentReference, データ) のリスト
+    """
     batch = db.batch()
-    deleted_count = 0
-    for doc in old_messages_query:
-        batch.delete(doc.reference)
-        deleted_count += 1
-    
-    if deleted_count > 0:
-        batch.commit()
+    for op, ref, data in ops:
+        if op == 'delete':
+            batch.delete(ref)
+        elif op == 'update':
+            # 対象ドキュメントが存在しない場合はバッチ全体が失敗する
+            batch.update(ref, data)
+        elif op == 'merge':
+            batch.set(ref, data, merge=True)
+        else:
+            batch.set(ref, data)
+    batch.commit()
+    invalidate_month_cache(year, month)
+
+def set_day_held(year, month, day, is_held):
+    """1日分の開催状況を書き込む"""
+    month_id = f"{year}-{month:02d}"
+    ref = db.collection(MONTH_STATUS_COLLECTION).document(month_id)
+    # 他の日の開催状況は古い可能性があるので、変更した日だけを書き込む
+    commit_writes(year, month, [('merge', ref, {f"{day:02d}": is_held})])
 
 # --- UIコンポーネントとロジック ---
 
@@ -235,9 +391,7 @@ def show_main_app():
     st.success(f"**{st.session_state.user_name}** さん（{st.session_state.user_attribute}）、こんにちは！")
     
     # --- 追加: 24時間以内の掲示板書き込みアラート ---
-    year = st.session_state.current_date.year
-    month = st.session_state.current_date.month
-    _, _, _, board_messages = get_firestore_data(year, month)
+    board_messages = get_board_messages()
     
     now_jst = datetime.now(JST)
     twenty_four_hours_ago = now_jst - timedelta(hours=24)
@@ -301,7 +455,15 @@ def show_calendar():
     month = st.session_state.current_date.month
     month_id = f"{year}-{month:02d}"
 
-    events, day_status, is_month_locked, _ = get_firestore_data(year, month)
+    events, day_status = get_month_data_stale_first(year, month)
+    is_month_locked = get_month_lock(year, month)
+    # 「前の月」「次の月」への移動に備えて先読みしておく
+    prefetch_adjacent_months(year, month)
+
+    # 日付ごとのシフトを一度だけ振り分けておく（セルごとに全件走査しない）
+    events_by_date = defaultdict(list)
+    for doc_id, data in events.items():
+        events_by_date[data.get('date')].append((doc_id, data))
 
     header_cols = st.columns([1, 2, 1])
     if header_cols[0].button("<< 前の月"):
@@ -313,8 +475,7 @@ def show_calendar():
         st.rerun()
 
     # 属性カラーの凡例表示
-    legend_html = " &nbsp;&nbsp;|&nbsp;&nbsp; ".join([f"<span style='color:{color}; font-weight:bold;'>■ {attr}</span>" for attr, color in USER_ATTRIBUTES.items()])
-    st.markdown(f"<div style='text-align:center; padding: 10px; background-color: #f0f2f6; border-radius: 5px; margin-bottom: 10px;'>{legend_html}</div>", unsafe_allow_html=True)
+    st.markdown(LEGEND_HTML, unsafe_allow_html=True)
 
     if is_month_locked:
         st.error("🔒 この月はロックされているため、シフトの編集や掲示板への書き込みはできません。")
@@ -333,8 +494,8 @@ def show_calendar():
             
             day_name = days_of_week[i]
             date_str = f"{month_id}-{day:02d}"
-            is_held = day_status.get(date_str, {}).get('isHeld', False)
-            day_events = [data for data in events.values() if data.get('date') == date_str]
+            is_held = day_status.get(f"{day:02d}", False)
+            day_events = events_by_date.get(date_str, [])
             is_full = len(day_events) >= MAX_SHIFTS_PER_DAY
             
             with cols[i].container(border=True):
@@ -345,17 +506,17 @@ def show_calendar():
                 if st.session_state.admin_mode:
                     new_is_held = st.checkbox("開催", value=is_held, key=f"held_{date_str}", disabled=is_month_locked)
                     if new_is_held != is_held:
-                        db.collection(DAY_STATUS_COLLECTION).document(date_str).set({'isHeld': new_is_held, 'month_id': month_id})
-                        st.cache_data.clear(); st.rerun()
+                        set_day_held(year, month, day, new_is_held)
+                        st.rerun()
                 elif is_held:
                     st.success("開催日")
 
                 # シフトリスト表示（属性による色分け、分数の表示）
-                for event in day_events:
-                    doc_id = [k for k, v in events.items() if v == event][0]
+                for doc_id, event in day_events:
                     attr = event.get('attribute', 'その他')
                     text_color = USER_ATTRIBUTES.get(attr, 'gray')
                     minutes = event.get('minutes', MINUTES_PER_SHIFT)
+                    time_color = "red" if minutes != MINUTES_PER_SHIFT else "gray"
                     
                     # 自分が登録したシフトかどうかを判定（名前と属性の両方が一致するか）
                     is_own_shift = (event.get('name') == st.session_state.user_name and attr == st.session_state.user_attribute)
@@ -363,32 +524,32 @@ def show_calendar():
                     if st.session_state.admin_mode and not is_month_locked:
                         shift_cols = st.columns([5, 2, 2])
                         # 名前と現在の分数を表示
-                        time_color = "red" if minutes != MINUTES_PER_SHIFT else "gray"
-                        shift_cols[0].markdown(f"<div style='line-height:1.2;'><span style='color:{text_color}; font-size:0.9em;'>👤 {event.get('name')}</span><br><span style='color:{time_color}; font-size:0.8em;'>({minutes}分)</span></div>", unsafe_allow_html=True)
+                        shift_cols[0].markdown(_ADMIN_SHIFT_TMPL.format_map({'text_color': text_color, 'name': event.get('name'), 'time_color': time_color, 'minutes': minutes}), unsafe_allow_html=True)
                         
                         # 管理者用の分数変更ポップオーバー
                         with shift_cols[1].popover("⏱️", help="活動時間を変更"):
                             st.write(f"**{event.get('name')}** さんの時間")
                             new_min = st.number_input("分数", value=minutes, step=5, min_value=0, key=f"min_{doc_id}")
+                            # 入力のたびに書き込まず、保存ボタンが押されるまで溜めておく
                             if new_min != minutes:
-                                db.collection(EVENTS_COLLECTION).document(doc_id).update({'minutes': new_min})
-                                st.cache_data.clear(); st.rerun()
+                                st.session_state.pending_minutes[doc_id] = new_min
+                            else:
+                                st.session_state.pending_minutes.pop(doc_id, None)
                                 
                         # 削除ボタン
                         if shift_cols[2].button("✖️", key=f"del_{doc_id}", help="削除"):
-                            db.collection(EVENTS_COLLECTION).document(doc_id).delete()
-                            st.cache_data.clear(); st.rerun()
+                            commit_writes(year, month, [('delete', db.collection(EVENTS_COLLECTION).document(doc_id), None)])
+                            st.rerun()
                     else:
                         shift_cols = st.columns([4, 1])
                         # 一般ユーザー向けの表示
                         display_name = f"**{event.get('name')}**" if is_own_shift else f"{event.get('name')}"
-                        time_color = "red" if minutes != MINUTES_PER_SHIFT else "gray"
-                        shift_cols[0].markdown(f"<span style='color:{text_color}; font-size:0.9em;'>👤 {display_name}</span> <span style='color:{time_color}; font-size:0.8em;'>({minutes}分)</span>", unsafe_allow_html=True)
+                        shift_cols[0].markdown(_SHIFT_TMPL.format_map({'text_color': text_color, 'name': display_name, 'time_color': time_color, 'minutes': minutes}), unsafe_allow_html=True)
                         
                         if is_own_shift and not is_month_locked:
                             if shift_cols[1].button("✖️", key=f"del_{doc_id}", help="削除"):
-                                db.collection(EVENTS_COLLECTION).document(doc_id).delete()
-                                st.cache_data.clear(); st.rerun()
+                                commit_writes(year, month, [('delete', db.collection(EVENTS_COLLECTION).document(doc_id), None)])
+                                st.rerun()
                 
                 if is_held and not is_month_locked:
                     if not is_full:
@@ -403,31 +564,51 @@ def show_calendar():
                                             'name': admin_add_name,
                                             'attribute': admin_add_attr,
                                             'minutes': MINUTES_PER_SHIFT,
-                                            'createdAt': firestore.SERVER_TIMESTAMP,
-                                            'uid': str(uuid.uuid4())
+                                            'createdAt': firestore.SERVER_TIMESTAMP
                                         }
-                                        db.collection(EVENTS_COLLECTION).add(new_event)
-                                        st.cache_data.clear(); st.rerun()
+                                        commit_writes(year, month, [('set', db.collection(EVENTS_COLLECTION).document(), new_event)])
+                                        st.rerun()
                         else:
                             if st.button("シフトに入る", key=f"add_{date_str}"):
-                                # 名前と属性の両方が一致するデータが既にあるかチェック
-                                is_already_in = any(e.get('name') == st.session_state.user_name and e.get('attribute', 'その他') == st.session_state.user_attribute for e in day_events)
-                                if not is_already_in:
-                                    new_event = {
-                                        'date': date_str, 'month_id': month_id,
-                                        'name': st.session_state.user_name,
-                                        'attribute': st.session_state.user_attribute,
-                                        'minutes': MINUTES_PER_SHIFT,
-                                        'createdAt': firestore.SERVER_TIMESTAMP,
-                                        'uid': str(uuid.uuid4())
-                                    }
-                                    db.collection(EVENTS_COLLECTION).add(new_event)
-                                    st.cache_data.clear(); st.rerun()
-                                else:
+                                new_event = {
+                                    'date': date_str, 'month_id': month_id,
+                                    'name': st.session_state.user_name,
+                                    'attribute': st.session_state.user_attribute,
+                                    'minutes': MINUTES_PER_SHIFT,
+                                    'createdAt': firestore.SERVER_TIMESTAMP
+                                }
+                                # 名前と属性の重複・定員はトランザクション内で確認する
+                                result = join_shift(new_event)
+                                invalidate_month_cache(year, month)
+                                if result == 'created':
+                                    st.rerun()
+                                elif result == 'exists':
                                     st.warning("すでに入っています。")
+                                else:
+                                    st.warning("満員のため登録できませんでした。")
                     else:
                         st.error("🈵 満員です")
 
+    # 管理者が変更した分数をまとめて保存する
+    pending_minutes = {doc_id: m for doc_id, m in st.session_state.pending_minutes.items() if doc_id in events}
+    if st.session_state.admin_mode and not is_month_locked and pending_minutes:
+        if st.button(f"💾 分数の変更を保存（{len(pending_minutes)}件）", type="primary"):
+            # 表示中のデータは古い場合があるため、他の利用者に削除されたシフトは保存対象から外す
+            refs = [db.collection(EVENTS_COLLECTION).document(doc_id) for doc_id in pending_minutes]
+            existing_ids = {snapshot.id for snapshot in db.get_all(refs, field_paths=['date']) if snapshot.exists}
+            ops = [('update', ref, {'minutes': pending_minutes[ref.id]}) for ref in refs if ref.id in existing_ids]
+            try:
+                # update は存在しないドキュメントを作らないので、削除済みのシフトが復活することはない
+                commit_writes(year, month, ops)
+            except NotFound:
+                invalidate_month_cache(year, month)
+                st.warning("保存中にシフトが削除されたため、保存できませんでした。もう一度お試しください。")
+            else:
+                # コミットに成功した分（と削除済みのシフト）だけ保存待ちから外す
+                for doc_id in pending_minutes:
+                    st.session_state.pending_minutes.pop(doc_id, None)
+                st.rerun()
+
 def show_activity_record():
     """活動実績の集計結果を表示する"""
     year = st.session_state.current_date.year
@@ -436,35 +617,24 @@ def show_activity_record():
     st.divider()
     st.subheader(f"⏱️ {year}年{month}月の活動実績")
     
-    events, _, is_month_locked, _ = get_firestore_data(year, month)
-    
-    if not is_month_locked:
+    if not get_month_lock(year, month):
         st.info(f"ℹ️ {month}月のシフトはまだ管理者によってロック（確定）されていないため、活動実績は表示されません。")
         return
+
+    events, _ = get_events_and_status(year, month)
     
-    # 属性を含めて集計する（同姓同名でも属性が違えば別として扱う）
-    user_data = {}
-    for event in events.values():
-        name = event.get('name')
-        attr = event.get('attribute', 'その他')
-        if name:
-            # 名前と属性の組み合わせをキーにする
-            key = (name, attr)
-            if key not in user_data:
-                user_data[key] = {
-                    'お名前': name,
-                    '属性': attr,
-                    '活動時間(分)': 0
-                }
-            user_data[key]['活動時間(分)'] += event.get('minutes', MINUTES_PER_SHIFT)
-            
-    if not user_data:
+    df = pd.DataFrame(list(events.values()), columns=['name', 'attribute', 'minutes'])
+    # 名前のない古いデータは集計対象外
+    df = df[df['name'].notna() & (df['name'] != '')]
+
+    if df.empty:
         st.write("この月の活動記録はありません。")
     else:
-        # 表に表示しやすい形（リスト）に変換
-        data_list = list(user_data.values())
-            
-        df = pd.DataFrame(data_list)
+        df['minutes'] = df['minutes'].fillna(MINUTES_PER_SHIFT).astype(int)
+        df['attribute'] = df['attribute'].fillna('その他')
+        # 属性を含めて集計する（同姓同名でも属性が違えば別として扱う）
+        df = df.groupby(['name', 'attribute'], as_index=False)['minutes'].sum()
+        df = df.rename(columns={'name': 'お名前', 'attribute': '属性', 'minutes': '活動時間(分)'})
         df = df.sort_values(by=['活動時間(分)', 'お名前'], ascending=[False, True]).reset_index(drop=True)
         # hide_index=True を指定して、一番左の連番（0, 1, 2...）を非表示にする
         st.dataframe(df, use_container_width=True, hide_index=True)
@@ -474,7 +644,7 @@ def show_board_and_info():
     year = st.session_state.current_date.year
     month = st.session_state.current_date.month
     month_id = f"{year}-{month:02d}"
-    _, _, is_month_locked, board_messages = get_firestore_data(year, month)
+    board_messages = get_board_messages()
 
     st.divider()
     col1, col2 = st.columns(2)
@@ -490,10 +660,12 @@ def show_board_and_info():
                 if name_input and message_input:
                     new_message = {
                         'month_id': month_id, 'name': name_input,
-                        'message': message_input, 'timestamp': firestore.SERVER_TIMESTAMP
+                        'message': message_input, 'timestamp': firestore.SERVER_TIMESTAMP,
+                        # FirestoreのTTLポリシーがこの時刻を過ぎたメッセージを自動削除する
+                        'expireAt': datetime.now(JST) + BOARD_MESSAGE_TTL
                     }
                     db.collection(BOARD_COLLECTION).add(new_message)
-                    st.cache_data.clear(); st.rerun()
+                    get_board_messages.clear(); st.rerun()
                 else:
                     st.warning("お名前とメッセージを入力してください。")
         
@@ -553,17 +725,17 @@ def show_admin_sidebar():
             year = st.session_state.current_date.year
             month = st.session_state.current_date.month
             month_id = f"{year}-{month:02d}"
-            _, _, is_month_locked, _ = get_firestore_data(year, month)
+            is_month_locked = get_month_lock(year, month)
             
             st.subheader("月のロック管理")
             if is_month_locked:
                 if st.button(f"🔓 {month}月をロック解除"):
                     db.collection(MONTH_LOCKS_COLLECTION).document(month_id).set({'isLocked': False})
-                    st.cache_data.clear(); st.rerun()
+                    get_month_lock.clear(year, month); st.rerun()
             else:
                 if st.button(f"🔴 {month}月をロックする"):
                     db.collection(MONTH_LOCKS_COLLECTION).document(month_id).set({'isLocked': True})
-                    st.cache_data.clear(); st.rerun()
+                    get_month_lock.clear(year, month); st.rerun()
 
             st.divider()
 
@@ -576,8 +748,9 @@ def generate_admin_csv(year, month):
     """行政報告用のマトリックス形式CSVを生成する"""
     month_id = f"{year}-{month:02d}"
     with st.spinner("集計中..."):
-        events_ref = db.collection(EVENTS_COLLECTION).where('month_id', '==', month_id).stream()
-        events_list = [doc.to_dict() for doc in events_ref]
+        # カレンダー表示でキャッシュ済みのシフトデータを再利用する
+        events, _ = get_events_and_status(year, month)
+        events_list = list(events.values())
         
         if not events_list:
             st.sidebar.warning(f"{month}月のシフトデータがありません。")
@@ -585,10 +758,12 @@ def generate_admin_csv(year, month):
             
         df = pd.DataFrame(events_list)
         
+        # 集計が数値の高速な経路を通るよう、分数は一度だけ整数型に揃えておく
         if 'minutes' not in df.columns:
             df['minutes'] = MINUTES_PER_SHIFT
         else:
-            df['minutes'] = df['minutes'].fillna(MINUTES_PER_SHIFT)
+            df['minutes'] = pd.to_numeric(df['minutes'], errors='coerce').fillna(MINUTES_PER_SHIFT)
+        df['minutes'] = df['minutes'].astype('int64')
             
         # 古いデータで属性がない場合への対応
         if 'attribute' not in df.columns:
@@ -636,10 +811,6 @@ if __name__ == "__main__":
         
         show_admin_sidebar()
 
-        if 'cleanup_done' not in st.session_state:
-            cleanup_old_board_messages()
-            st.session_state.cleanup_done = True
-
         if not st.session_state.user_name:
             show_welcome_and_name_input()
         else:
@@ -0,0 +1,52 @@
+"""旧形式の開催状況（v2_day_status）を月ステータス（v2_month_status）へ移行する1回限りのスクリプト
+
+使い方: プロジェクトのルートで `python migrate_day_status.py` を実行する
+（.streamlit/secrets.toml の [firebase] の認証情報を使用する）
+"""
+import tomllib
+from collections import defaultdict
+
+import firebase_admin
+from firebase_admin import credentials, firestore
+from google.api_core.exceptions import AlreadyExists
+
+DAY_STATUS_COLLECTION = "v2_day_status"
+MONTH_STATUS_COLLECTION = "v2_month_status"
+SECRETS_PATH = ".streamlit/secrets.toml"
+
+
+def init_firestore():
+    """secrets.toml の認証情報でFirestoreクライアントを作成する"""
+    with open(SECRETS_PATH, "rb") as f:
+        creds_dict = dict(tomllib.load(f)["firebase"])
+    if "private_key" in creds_dict:
+        creds_dict['private_key'] = creds_dict['private_key'].replace('\\n', '\n')
+
+    firebase_admin.initialize_app(credentials.Certificate(creds_dict))
+    return firestore.client()
+
+
+def main():
+    db = init_firestore()
+
+    # month_id -> {"日(2桁)": 開催するか}
+    month_statuses = defaultdict(dict)
+    for doc in db.collection(DAY_STATUS_COLLECTION).stream():
+        data = doc.to_dict()
+        month_id = data.get('month_id')
+        if not month_id:
+            continue
+        # ドキュメントIDは日付（例: 2026-04-01）なので、末尾2桁が日になる
+        month_statuses[month_id][doc.id[-2:]] = data.get('isHeld', False)
+
+    for month_id, day_status in sorted(month_statuses.items()):
+        try:
+            # アプリ側で既に月ステータスが作られている月は、そちらを正として上書きしない
+            db.collection(MONTH_STATUS_COLLECTION).document(month_id).create(day_status)
+            print(f"{month_id}: {len(day_status)}日分を移行しました")
+        except AlreadyExists:
+            print(f"{month_id}: 月ステータスが既にあるためスキップしました")
+
+
+if __name__ == "__main__":
+    main()